@@ -48,9 +48,21 @@ DEFAULT_SPM_PATH = "gs://t5-data/vocabs/cc_all.32000/sentencepiece.model"  # GCS
 DEFAULT_EXTRA_IDS = 100
 
 
+_DEFAULT_VOCABULARY = None
+
+
 def get_default_vocabulary():
-  return sentencepiece_vocabulary.SentencePieceVocabulary(
-      DEFAULT_SPM_PATH, DEFAULT_EXTRA_IDS)
+  """Returns a shared SentencePieceVocabulary for the default SPM.
+
+  The vocabulary is created once and reused so repeated callers (e.g. one
+  `predict` call per checkpoint) don't each re-read the SentencePiece model
+  from GCS.
+  """
+  global _DEFAULT_VOCABULARY
+  if _DEFAULT_VOCABULARY is None:
+    _DEFAULT_VOCABULARY = sentencepiece_vocabulary.SentencePieceVocabulary(
+        DEFAULT_SPM_PATH, DEFAULT_EXTRA_IDS)
+  return _DEFAULT_VOCABULARY
 
 
 
@@ -78,14 +78,17 @@ model.predict(
 
 """
 
-import functools
+import concurrent.futures
+import contextlib
 import itertools
 import os
-import re
+import queue
+import threading
 import time
 
 from absl import logging
 import mesh_tensorflow.transformer.dataset as transformer_dataset
+import numpy as np
 import t5.data
 from t5.models.t5_model import T5Model
 import tensorflow.compat.v1 as tf
@@ -95,8 +98,179 @@ import torch.utils.tensorboard
 
 CHECKPOINT_FILE_FORMAT = "model-{}.checkpoint"
 
+# Marks the end of a batch stream on a prefetch queue.
+_SENTINEL = object()
+
+
+def _checkpoint_step_from_path(path):
+  """Returns the step encoded in a `model-<step>.checkpoint` path."""
+  # Anchor on the basename so the cost doesn't scale with the directory
+  # prefix when listing many checkpoints.
+  basename = os.path.basename(path)
+  return int(basename.split("-", 1)[1].split(".", 1)[0])
+
+
+class _Prefetcher:
+  """Iterator that pulls from a generator on a background thread.
+
+  Running the tf.data pipeline on a worker thread and handing finished
+  batches over a bounded queue lets CPU preprocessing overlap with the
+  consumer's (GPU) work instead of serializing with it.
+  """
+
+  def __init__(self, generator, size=4):
+    """Constructor for _Prefetcher.
+
+    Args:
+      generator: an iterable of batches to pull from.
+      size: int, the maximum number of batches to buffer ahead.
+    """
+    self._queue = queue.Queue(maxsize=size)
+    self._closed = False
+    self._error = None
+    self._thread = threading.Thread(
+        target=self._fill, args=(generator,), daemon=True
+    )
+    self._thread.start()
+
+  def _put(self, item):
+    """Enqueue `item`, giving up if the prefetcher is closed meanwhile."""
+    while not self._closed:
+      try:
+        self._queue.put(item, timeout=1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _fill(self, generator):
+    try:
+      for batch in generator:
+        if not self._put(batch):
+          return
+    except Exception as e:  # pylint: disable=broad-except
+      self._error = e
+    finally:
+      self._put(_SENTINEL)
+
+  def close(self):
+    """Release the fill thread and the underlying pipeline.
+
+    Consumers that stop before exhausting the source (e.g. a steps-bounded
+    training run) must call this, or the fill thread blocks forever on a
+    full queue. Safe to call at any point; the iterator must not be used
+    afterwards.
+    """
+    self._closed = True
 
-def tokens_to_batches(dataset, sequence_length, batch_size, output_features):
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    batch = self._queue.get()
+    if batch is _SENTINEL:
+      if self._error is not None:
+        raise self._error
+      raise StopIteration
+    return batch
+
+
+class _PinnedBatchLoader:
+  """Stages numpy batches in pinned host memory for async device transfer.
+
+  A background thread packs each numpy batch's numeric features into a single
+  flat pinned host buffer (drawn from a small reusable ring) so the tf.data
+  pipeline runs concurrently with GPU compute. Iterating yields batches of
+  device tensors backed by one fused host-to-device copy per batch, issued on
+  a dedicated CUDA stream with `non_blocking=True`, letting the transfer of
+  one batch overlap with the previous batch's forward and backward passes.
+  """
+
+  def __init__(self, batches, device, num_prefetch=2):
+    """Constructor for _PinnedBatchLoader.
+
+    Args:
+      batches: an iterable of dicts mapping feature names to numpy arrays.
+      device: `torch.device` to copy batches to. Must be a CUDA device.
+      num_prefetch: int, the number of batches to stage ahead of the consumer.
+    """
+    self._device = device
+    self._copy_stream = torch.cuda.Stream(device)
+    self._queue = queue.Queue(maxsize=num_prefetch)
+    # One slot per queue entry, plus one being staged and one being consumed.
+    self._slots = [
+        {"buffer": None, "event": torch.cuda.Event()}
+        for _ in range(num_prefetch + 2)
+    ]
+    self._error = None
+    self._thread = threading.Thread(
+        target=self._stage_batches, args=(batches,), daemon=True
+    )
+    self._thread.start()
+
+  def _stage_batches(self, batches):
+    """Packs each batch's numeric features into one flat pinned buffer."""
+    try:
+      for index, batch in enumerate(batches):
+        slot = self._slots[index % len(self._slots)]
+        # Make sure the device has finished reading from this slot's buffer
+        # before overwriting it.
+        slot["event"].synchronize()
+        layout = []
+        passthrough = {}
+        sources = []
+        flat_size = 0
+        for key, array in batch.items():
+          if not isinstance(array, np.ndarray) or array.dtype.kind not in (
+              "biuf"):
+            # Pass through non-numeric features (e.g. plaintext) untouched.
+            passthrough[key] = array
+            continue
+          source = torch.from_numpy(array).reshape(-1)
+          if source.dtype != torch.int64:
+            source = source.long()
+          layout.append((key, array.shape, flat_size, source.numel()))
+          sources.append(source)
+          flat_size += source.numel()
+        buffer = slot["buffer"]
+        if buffer is None or buffer.numel() < flat_size:
+          buffer = torch.empty(flat_size, dtype=torch.int64, pin_memory=True)
+          slot["buffer"] = buffer
+        for (_, _, offset, numel), source in zip(layout, sources):
+          buffer[offset:offset + numel].copy_(source)
+        self._queue.put(
+            (buffer, flat_size, layout, passthrough, slot["event"])
+        )
+    except Exception as e:  # pylint: disable=broad-except
+      self._error = e
+    finally:
+      self._queue.put(_SENTINEL)
+
+  def __iter__(self):
+    while True:
+      item = self._queue.get()
+      if item is _SENTINEL:
+        if self._error is not None:
+          raise self._error
+        return
+      buffer, flat_size, layout, passthrough, event = item
+      # A single fused copy instead of one cudaMemcpyAsync per feature.
+      with torch.cuda.stream(self._copy_stream):
+        flat = buffer[:flat_size].to(self._device, non_blocking=True)
+      event.record(self._copy_stream)
+      # Compute on the default stream must wait for the copy to land, and
+      # the device tensor must not be reclaimed until that stream is done
+      # with it.
+      torch.cuda.current_stream().wait_stream(self._copy_stream)
+      flat.record_stream(torch.cuda.current_stream())
+      batch = dict(passthrough)
+      for key, shape, offset, numel in layout:
+        batch[key] = flat[offset:offset + numel].view(shape)
+      yield batch
+
+
+def tokens_to_batches(dataset, sequence_length, batch_size, output_features,
+                      bucket_by_length=False):
   """Convert a dataset of token sequences to batches of padded/masked examples.
 
   Args:
@@ -104,35 +278,49 @@ def tokens_to_batches(dataset, sequence_length, batch_size, output_features):
     sequence_length: dict of int, a dict mapping feature name to length.
     batch_size: int, the number of padded sequences in each batch.
     output_features: list of str, features to include in the dataset.
+    bucket_by_length: bool, whether to group examples of similar input length
+      together and pad each batch only to its longest example, instead of
+      padding everything to `sequence_length`. Batches then have varying
+      sequence lengths, which reduces wasted compute on padding when example
+      lengths are skewed.
 
   Returns:
     A generator that produces batches of numpy examples.
   """
-  dataset = transformer_dataset.pack_or_pad(
-      dataset,
-      sequence_length,
-      pack=False,
-      feature_keys=output_features,
-      ensure_eos=True,
-  )
-
-  def _map_fn(ex):
-    for key in output_features:
-      tensor = ex[key]
-      mask = tf.cast(tf.greater(tensor, 0), tensor.dtype)
-      ex[key + "_mask"] = mask
-    return ex
-
-  dataset = dataset.map(
-      _map_fn,
-      num_parallel_calls=t5.data.preprocessors.num_parallel_calls()
-  )
+  if bucket_by_length:
+    # The examples arriving here are already trimmed to sequence_length and
+    # EOS-terminated by the Task's token preprocessing, so they can be
+    # bucketed directly; each bucket pads to its longest example.
+    max_length = sequence_length["inputs"]
+    bucket_boundaries = sorted(
+        {length for length in (max_length // 4, max_length // 2,
+                               3 * max_length // 4, max_length)
+         if length > 0}
+    )
+    dataset = dataset.apply(
+        tf.data.experimental.bucket_by_sequence_length(
+            element_length_func=lambda ex: tf.shape(ex["inputs"])[0],
+            bucket_boundaries=bucket_boundaries,
+            bucket_batch_sizes=[batch_size] * (len(bucket_boundaries) + 1),
+            pad_to_bucket_boundary=False,
+        )
+    )
+  else:
+    dataset = transformer_dataset.pack_or_pad(
+        dataset,
+        sequence_length,
+        pack=False,
+        feature_keys=output_features,
+        ensure_eos=True,
+    )
 
-  dataset = dataset.batch(batch_size, drop_remainder=False)
+    dataset = dataset.batch(batch_size, drop_remainder=False)
+  dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
   return tfds.as_numpy(dataset)
 
 
-def get_dataset(mixture_or_task_name, sequence_length, split, batch_size):
+def get_dataset(mixture_or_task_name, sequence_length, split, batch_size,
+                bucket_by_length=False):
   """Get a generator of numpy examples for a given Task or Mixture.
 
   Args:
@@ -142,6 +330,8 @@ def get_dataset(mixture_or_task_name, sequence_length, split, batch_size):
     sequence_length: dict of int, a dict mapping feature name to length.
     split: str or `tensorflow_datasets.Split`, the data split to load.
     batch_size: int, the number of padded sequences in each batch.
+    bucket_by_length: bool, whether to batch examples of similar length
+      together; see `tokens_to_batches`.
 
   Returns:
     A generator that produces batches of numpy examples.
@@ -149,16 +339,77 @@ def get_dataset(mixture_or_task_name, sequence_length, split, batch_size):
   task = t5.data.get_mixture_or_task(mixture_or_task_name)
   ds = task.get_dataset(sequence_length, split)
   return tokens_to_batches(
-      ds, sequence_length, batch_size, tuple(task.output_features)
+      ds, sequence_length, batch_size, tuple(task.output_features),
+      bucket_by_length=bucket_by_length
   )
 
 
 def write_lines_to_file(lines, filename):
   """Write each line to filename, replacing the file if it exists."""
-  if tf.io.gfile.exists(filename):
-    tf.io.gfile.remove(filename)
+  # Opening in "w" mode truncates, so there is no need for an exists/remove
+  # round trip, and streaming the lines avoids materializing one giant
+  # joined string in memory.
   with tf.io.gfile.GFile(filename, "w") as output_file:
-    output_file.write("\n".join([str(l) for l in lines]))
+    for line in lines:
+      output_file.write(str(line))
+      output_file.write("\n")
+
+
+def _decode_token_lists(vocab, token_lists):
+  """Decode a batch of token id lists, in one C++ call when supported.
+
+  SentencePiece can decode a list of id lists in a single call, avoiding a
+  Python-to-C++ transition per sequence. Falls back to per-sequence
+  `vocab.decode` for vocabularies without a batch decoder.
+
+  Args:
+    vocab: a t5.data.vocabularies.Vocabulary.
+    token_lists: a list of lists of int token ids.
+
+  Returns:
+    A list of decoded strings, one per entry in `token_lists`.
+  """
+  tokenizer = getattr(vocab, "tokenizer", None)
+  if tokenizer is not None:
+    try:
+      piece_size = tokenizer.GetPieceSize()
+      unk_id = tokenizer.unk_id()
+      # Convert extra ids (sentinels) to UNK, as `vocab.decode` does.
+      cleaned = [
+          [unk_id if i >= piece_size else i for i in ids]
+          for ids in token_lists
+      ]
+      return list(tokenizer.DecodeIds(cleaned))
+    except (AttributeError, TypeError, RuntimeError):
+      pass
+  return [vocab.decode(ids) for ids in token_lists]
+
+
+def _trim_generated_tokens(predicted_tokens, eos_id=1):
+  """Truncate generated sequences at the first EOS, trimming on-device.
+
+  The first EOS position of each row is found with a vectorized op on the
+  device, and only the prefix up to the batch's longest sequence is moved to
+  the host. This cuts device-to-host bytes and keeps the per-row Python
+  lists handed to the vocabulary decoder short.
+
+  Args:
+    predicted_tokens: a (batch, length) torch tensor of generated token ids.
+    eos_id: int, the EOS token id.
+
+  Returns:
+    A list of lists of ints, one per row, each ending before the first EOS.
+  """
+  is_eos = predicted_tokens.eq(eos_id)
+  has_eos = is_eos.any(dim=1)
+  first_eos = torch.where(
+      has_eos,
+      is_eos.int().argmax(dim=1),
+      torch.full_like(has_eos, predicted_tokens.size(1), dtype=torch.long),
+  )
+  lengths = first_eos.cpu().tolist()
+  trimmed = predicted_tokens[:, :max([1] + lengths)].cpu().numpy()
+  return [row[:length].tolist() for row, length in zip(trimmed, lengths)]
 
 
 class HfPyTorchModel(T5Model):
@@ -196,14 +447,54 @@ class HfPyTorchModel(T5Model):
     self._device = device
     if self._device.type == "cuda":
       self._model.cuda()
+    self._checkpoint_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1
+    )
+    self._pending_checkpoint = None
+    self._checkpoint_steps_cache = None
+    # Number of training steps between TensorBoard loss summaries. Each
+    # summary forces a device-to-host sync, so don't log every step.
+    self._loss_log_interval = 50
     self._step = 0
     self.load_latest_checkpoint()
-    self.to_tensor = functools.partial(torch.as_tensor, device=self._device)
 
   @property
   def model(self):
     return self._model
 
+  def _to_device(self, value):
+    """Move a single numpy array (or already-staged tensor) to the device.
+
+    `torch.from_numpy` shares the underlying buffer with the numpy array, so
+    the only copy made is the one onto the device.
+
+    Args:
+      value: a numpy array or torch tensor.
+
+    Returns:
+      A torch tensor on `self._device`.
+    """
+    if not isinstance(value, torch.Tensor):
+      value = torch.from_numpy(value)
+    return value.to(self._device, non_blocking=True)
+
+  def _batch_to_device(self, batch):
+    """Move the numeric features of a batch to the device in one pass.
+
+    Args:
+      batch: dict mapping feature names to numpy arrays or torch tensors.
+
+    Returns:
+      A dict with the numeric features as tensors on `self._device`;
+      non-numeric features (e.g. plaintext) are passed through unchanged.
+    """
+    return {
+        key: self._to_device(value)
+        if isinstance(value, torch.Tensor) or value.dtype.kind in "biuf"
+        else value
+        for key, value in batch.items()
+    }
+
   @property
   def step(self):
     return self._step
@@ -211,11 +502,36 @@ class HfPyTorchModel(T5Model):
   def save_checkpoint(self, step):
     """Save the current model parameters to the `model_dir`.
 
+    A consistent CPU snapshot of the parameters is staged on the calling
+    thread, but the (much slower) disk write happens on a background thread
+    so the training loop doesn't stall on I/O. Use `_join_checkpoint_write`
+    to block until an in-flight write has finished.
+
     Args:
       step: int, the current training step.
     """
     path = os.path.join(self._model_dir, CHECKPOINT_FILE_FORMAT.format(step))
-    torch.save(self._model.state_dict(), path)
+    # Wait for any earlier write so at most one staged snapshot is held in
+    # memory at a time.
+    self._join_checkpoint_write()
+    staged = {
+        key: value.detach().to("cpu", copy=True)
+        for key, value in self._model.state_dict().items()
+    }
+    self._pending_checkpoint = self._checkpoint_executor.submit(
+        torch.save, staged, path
+    )
+    if self._checkpoint_steps_cache is None:
+      self._checkpoint_steps_cache = [step]
+    elif step not in self._checkpoint_steps_cache:
+      self._checkpoint_steps_cache.append(step)
+      self._checkpoint_steps_cache.sort()
+
+  def _join_checkpoint_write(self):
+    """Block until any in-flight checkpoint write has finished."""
+    if self._pending_checkpoint is not None:
+      self._pending_checkpoint.result()
+      self._pending_checkpoint = None
 
   def load_checkpoint(self, step, model_dir=None):
     """Load the model parameters from a checkpoint at a given step.
@@ -225,6 +541,7 @@ class HfPyTorchModel(T5Model):
       model_dir: str, the directory of the checkpoint to load or None to use
         this model's directory.
     """
+    self._join_checkpoint_write()
     model_dir = model_dir or self._model_dir
     path = os.path.join(model_dir, CHECKPOINT_FILE_FORMAT.format(step))
     logging.info("Loading from %s", path)
@@ -234,6 +551,10 @@ class HfPyTorchModel(T5Model):
   def get_all_checkpoint_steps(self, model_dir=None):
     """Retrieve the steps corresponding to all checkpoints in `model_dir`.
 
+    The listing for this model's own directory is cached to avoid repeated
+    filesystem round trips (which are costly on network filesystems);
+    `save_checkpoint` keeps the cache up to date.
+
     Args:
       model_dir: str, the directory of the checkpoints or None to use this
         model's directory.
@@ -242,15 +563,23 @@ class HfPyTorchModel(T5Model):
       A list of ints corresponding to all checkpoint steps, or None if there
         are no checkpoints in the model directory.
     """
+    use_cache = model_dir is None or model_dir == self._model_dir
+    if use_cache and self._checkpoint_steps_cache is not None:
+      # Return a copy: the cache is updated in place by `save_checkpoint`
+      # and must not be mutable through (or by) the caller.
+      return list(self._checkpoint_steps_cache)
     model_dir = model_dir or self._model_dir
     checkpoint_files = tf.io.gfile.glob(
         os.path.join(model_dir, CHECKPOINT_FILE_FORMAT.format("*"))
     )
     if not checkpoint_files:
       return
-    step_regex = re.compile(".*" + CHECKPOINT_FILE_FORMAT.format(r"(\d+)"))
-    steps = [int(step_regex.match(path).group(1)) for path in checkpoint_files]
-    return sorted(steps)
+    steps = sorted(
+        _checkpoint_step_from_path(path) for path in checkpoint_files
+    )
+    if use_cache:
+      self._checkpoint_steps_cache = list(steps)
+    return steps
 
   def get_latest_checkpoint_step(self, model_dir=None):
     """Retrieve the step corresponding to the most recent checkpoint.
@@ -283,6 +612,8 @@ class HfPyTorchModel(T5Model):
       batch_size,
       optimizer,
       learning_rate_scheduler=None,
+      bucket_by_length=False,
+      precision="fp32",
   ):
     """Train the model on the given Mixture or Task.
 
@@ -303,45 +634,168 @@ class HfPyTorchModel(T5Model):
         optimizer's learning rate after 100 steps, you could pass in
         `functools.partial(transformers.get_constant_schedule_with_warmup,
        num_warmup_steps=100)`.
+      bucket_by_length: bool, whether to batch examples of similar input
+        length together and pad each batch only to its longest example,
+        reducing wasted compute on padding; see `tokens_to_batches`.
+      precision: str, one of "fp32", "bf16" or "fp16". With "bf16" or "fp16"
+        the forward and backward passes run under autocast in the reduced
+        precision, halving activation bandwidth and enabling tensor cores;
+        the optimizer state and updates stay in fp32. Prefer "bf16" on
+        hardware that supports it since it needs no loss scaling.
     """
+    if precision not in ("fp32", "bf16", "fp16"):
+      raise ValueError(
+          f"precision must be one of 'fp32', 'bf16' or 'fp16'; got {precision}"
+      )
+    autocast_dtype = {
+        "bf16": torch.bfloat16,
+        "fp16": torch.float16,
+    }.get(precision)
+    scaler = None
+    if precision == "fp16" and self._device.type == "cuda":
+      # fp16 gradients underflow without loss scaling; bf16 does not need it.
+      scaler = torch.cuda.amp.GradScaler()
+
+    def _autocast():
+      if autocast_dtype is None:
+        return contextlib.nullcontext()
+      return torch.autocast(
+          device_type=self._device.type, dtype=autocast_dtype
+      )
+
     self._model.train()
-    ds = get_dataset(mixture_or_task_name, sequence_length, split, batch_size)
-    # Repeat dataset forever
-    ds = itertools.cycle(ds)
     optimizer = optimizer(self._model.parameters())
+    if self._device.type == "cuda" and type(optimizer) is torch.optim.AdamW:  # pylint: disable=unidiomatic-typecheck
+      # Rebuild with the fused CUDA kernel, which collapses the per-tensor
+      # elementwise updates into a single launch per parameter group. The
+      # rebuild starts from the constructor defaults, so it is only safe
+      # when the user hasn't customized per-group options (e.g. a
+      # decay/no-decay split).
+      groups = optimizer.param_groups
+      unmodified = len(groups) == 1 and all(
+          groups[0].get(key) == value
+          for key, value in optimizer.defaults.items()
+      )
+      if unmodified:
+        try:
+          optimizer = torch.optim.AdamW(
+              groups[0]["params"], **{**optimizer.defaults, "fused": True}
+          )
+        except (RuntimeError, TypeError, ValueError):
+          # Fused kernels unavailable on this torch build; keep the original.
+          pass
+      else:
+        logging.info(
+            "Not rebuilding AdamW with fused=True: the optimizer has "
+            "customized parameter groups."
+        )
     if learning_rate_scheduler:
       learning_rate_scheduler = learning_rate_scheduler(optimizer)
 
-    now = time.time()
-    for train_step, batch in enumerate(itertools.islice(ds, steps)):
+    # With a fixed sequence_length the training step has static shapes, so
+    # the forward pass can be specialized and kernel-fused; generation in
+    # eval/predict has dynamic shapes and stays eager. torch.compile itself
+    # only builds a lazy wrapper — dynamo/inductor failures surface on the
+    # first call — so that call is guarded below and training permanently
+    # falls back to eager if it raises.
+    model_fn = self._model
+    compile_attempted = not hasattr(torch, "compile")
+
+    def _forward(input_ids, labels):
+      # Compute the padding masks on-device rather than shipping them
+      # through the input pipeline; this halves the bytes copied per batch.
+      with _autocast():
+        return model_fn(
+            input_ids=input_ids,
+            attention_mask=input_ids.ne(0).to(input_ids.dtype),
+            decoder_attention_mask=labels.ne(0).to(labels.dtype),
+            lm_labels=labels,
+        )
 
-      if not train_step % save_steps:
-        # TODO(craffel): Consider saving optimizer and scheduler state.
-        logging.info("Saving checkpoint for step %s", self._step)
-        self.save_checkpoint(self._step)
+    ds = get_dataset(mixture_or_task_name, sequence_length, split, batch_size,
+                     bucket_by_length=bucket_by_length)
+    # Run the tf.data pipeline on a worker thread. A steps-bounded run
+    # abandons the iterator mid-stream, so the prefetcher must be closed
+    # when training ends to release its thread and the pipeline.
+    prefetcher = _Prefetcher(ds)
+    # Repeat dataset forever
+    ds = itertools.cycle(prefetcher)
 
-      self._model.zero_grad()
-      outputs = self._model(
-          input_ids=self.to_tensor(batch["inputs"]),
-          attention_mask=self.to_tensor(batch["inputs_mask"]),
-          decoder_attention_mask=self.to_tensor(batch["targets_mask"]),
-          lm_labels=self.to_tensor(batch["targets"]),
-      )
-      loss = outputs[0]
-      loss.backward()
-      optimizer.step()
-      if learning_rate_scheduler:
-        learning_rate_scheduler.step()
-
-      self._writer.add_scalar(
-          "loss", loss.detach().cpu().numpy(), self._step
-      )
-      self._writer.add_scalar("step/s", 1 / (time.time() - now), self._step)
-      now = time.time()
-      self._step += 1
+    try:
+      batches = itertools.islice(ds, steps)
+      if self._device.type == "cuda":
+        # Stage batches in pinned host memory and copy them to the GPU on a
+        # side stream so host-to-device transfer overlaps with compute.
+        batches = _PinnedBatchLoader(batches, self._device)
 
-    logging.info("Saving final checkpoint for step %s", self._step)
-    self.save_checkpoint(self._step)
+      loss_sum = 0.0
+      loss_count = 0
+      now = time.time()
+      for train_step, batch in enumerate(batches):
+
+        if not train_step % save_steps:
+          # TODO(craffel): Consider saving optimizer and scheduler state.
+          logging.info("Saving checkpoint for step %s", self._step)
+          self.save_checkpoint(self._step)
+
+        # Setting gradients to None skips a full-parameter memset each step.
+        self._model.zero_grad(set_to_none=True)
+        batch = self._batch_to_device(batch)
+        input_ids = batch["inputs"]
+        labels = batch["targets"]
+        if not compile_attempted:
+          compile_attempted = True
+          try:
+            model_fn = torch.compile(
+                self._model, mode="reduce-overhead", dynamic=bucket_by_length
+            )
+            outputs = _forward(input_ids, labels)
+          except Exception as e:  # pylint: disable=broad-except
+            logging.warning(
+                "torch.compile failed (%s); falling back to eager execution.",
+                e
+            )
+            model_fn = self._model
+            outputs = _forward(input_ids, labels)
+        else:
+          outputs = _forward(input_ids, labels)
+        loss = outputs[0]
+        if scaler is not None:
+          scaler.scale(loss).backward()
+          scaler.step(optimizer)
+          scaler.update()
+        else:
+          loss.backward()
+          optimizer.step()
+        if learning_rate_scheduler:
+          learning_rate_scheduler.step()
+
+        # Fold the loss into an on-device running sum and only sync a mean
+        # back every `_loss_log_interval` steps, so logging doesn't stall the
+        # pipeline with a device-to-host copy per step. The add reads the
+        # value immediately, which matters under reduce-overhead compilation
+        # where the output buffer is reused by later steps.
+        loss_sum = loss_sum + loss.detach()
+        loss_count += 1
+        if loss_count >= self._loss_log_interval:
+          self._writer.add_scalar(
+              "loss", loss_sum.item() / loss_count, self._step
+          )
+          loss_sum = 0.0
+          loss_count = 0
+        self._writer.add_scalar("step/s", 1 / (time.time() - now), self._step)
+        now = time.time()
+        self._step += 1
+
+      if loss_count:
+        self._writer.add_scalar(
+            "loss", loss_sum.item() / loss_count, self._step
+        )
+      logging.info("Saving final checkpoint for step %s", self._step)
+      self.save_checkpoint(self._step)
+      self._join_checkpoint_write()
+    finally:
+      prefetcher.close()
 
   def eval(
       self,
@@ -400,15 +854,18 @@ class HfPyTorchModel(T5Model):
     tf.io.gfile.makedirs(summary_dir)
 
     def _unbatch(batch):
-      """Converts a dict of lists to a list of dicts of singletons."""
-      return [dict(zip(batch, t)) for t in zip(*batch.values())]
+      """Lazily yields a dict of singletons per element of a batched dict."""
+      for values in zip(*batch.values()):
+        yield dict(zip(batch, values))
 
     # Pre-load in all of the targets once before doing eval
     cached_targets = {}
     cached_examples = {}
     for task in tasks:
       if task.metric_fns:
-        ds = get_dataset(task.name, sequence_length, split, batch_size)
+        ds = _Prefetcher(
+            get_dataset(task.name, sequence_length, split, batch_size)
+        )
         # Create list of postprocessed text targets
         batches = list(ds)
         if not batches:
@@ -429,26 +886,59 @@ class HfPyTorchModel(T5Model):
         inputs = [ex["inputs_plaintext"] for ex in examples]
         write_lines_to_file(inputs, inputs_filename)
 
+        # Re-batch the examples sorted by true input length so each batch can
+        # be right-trimmed to its longest example, cutting the padded length
+        # the encoder runs over during generation. The permutation is undone
+        # on the predictions before scoring, so targets stay aligned.
+        order = sorted(
+            range(len(examples)),
+            key=lambda i: int((examples[i]["inputs"] != 0).sum()),
+            reverse=True,
+        )
+        keys = list(examples[0])
+        sorted_batches = []
+        index_batches = []
+        for start in range(0, len(order), batch_size):
+          chunk = order[start:start + batch_size]
+          batch = {
+              key: np.stack([examples[i][key] for i in chunk]) for key in keys
+          }
+          max_len = max(1, int((batch["inputs"] != 0).sum(axis=1).max()))
+          batch["inputs"] = batch["inputs"][:, :max_len]
+          if self._device.type == "cuda":
+            # Stage the inputs in pinned host memory once, so evaluating K
+            # checkpoints pays K fast non-blocking device copies instead of
+            # K pageable transfers of identical data.
+            batch["inputs"] = np.ascontiguousarray(batch["inputs"])
+            batch["inputs"] = torch.from_numpy(batch["inputs"]).pin_memory()
+          sorted_batches.append(batch)
+          index_batches.append(chunk)
+
         cached_targets[task.name] = targets
-        cached_examples[task.name] = batches
+        cached_examples[task.name] = (sorted_batches, index_batches)
 
     def _eval_current_model():
       self._model.eval()
       for task in tasks:
-        ds = cached_examples[task.name]
+        batches, index_batches = cached_examples[task.name]
         targets = cached_targets[task.name]
-        predictions = []
-        for batch in ds:
-          predicted_tokens = self._model.generate(
-              input_ids=self.to_tensor(batch["inputs"]), **generate_kwargs
-          )
-          predicted_tokens = predicted_tokens.cpu().numpy().tolist()
-          predictions.extend(
-              [
-                  task.postprocess_fn(vocab.decode(p), example=ex)
-                  for p, ex in zip(predicted_tokens, _unbatch(batch))
-              ]
-          )
+        indexed_predictions = []
+        # inference_mode skips autograd bookkeeping entirely, which is pure
+        # overhead during generation.
+        with torch.inference_mode():
+          for batch, indices in zip(batches, index_batches):
+            predicted_tokens = self._model.generate(
+                input_ids=self._to_device(batch["inputs"]), **generate_kwargs
+            )
+            predicted_tokens = _trim_generated_tokens(predicted_tokens)
+            decoded = _decode_token_lists(vocab, predicted_tokens)
+            indexed_predictions.extend(
+                (index, task.postprocess_fn(text, example=ex))
+                for index, text, ex in zip(indices, decoded, _unbatch(batch))
+            )
+        # Undo the length-sorted permutation from the pre-load step.
+        indexed_predictions.sort(key=lambda pair: pair[0])
+        predictions = [prediction for _, prediction in indexed_predictions]
 
         if len(targets) != len(predictions):
           raise ValueError(
@@ -543,24 +1033,41 @@ class HfPyTorchModel(T5Model):
     else:
       raise ValueError("vocabulary must be a dict, a Vocabulary, or None")
 
-    dataset = tf.data.Dataset.from_tensor_slices(inputs)
-    dataset = dataset.map(
-        lambda x: {"inputs": tf.cast(vocabs["inputs"].encode_tf(x), tf.int64)},
-        num_parallel_calls=t5.data.preprocessors.num_parallel_calls()
-    )
-    dataset = tokens_to_batches(
-        dataset, sequence_length, batch_size, ["inputs"]
-    )
+    # Encode everything in one pass through the Python tokenizer (a single
+    # C++ call when the vocabulary supports batching) and build padded numpy
+    # batches directly; spinning up a tf.data pipeline per predict call
+    # costs more than the encoding itself for small input lists.
+    tokenizer = getattr(vocabs["inputs"], "tokenizer", None)
+    encoded = None
+    if tokenizer is not None:
+      try:
+        encoded = tokenizer.EncodeAsIds(list(inputs))
+      except (AttributeError, TypeError, RuntimeError):
+        encoded = None
+    if encoded is None:
+      encoded = [vocabs["inputs"].encode(line) for line in inputs]
+    max_length = sequence_length["inputs"]
+    # Trim to leave room for EOS (id 1), as `tokens_to_batches` would.
+    rows = [list(ids[:max_length - 1]) + [1] for ids in encoded]
+    dataset = []
+    for start in range(0, len(rows), batch_size):
+      chunk = rows[start:start + batch_size]
+      longest = max(len(row) for row in chunk)
+      array = np.zeros((len(chunk), longest), dtype=np.int64)
+      for i, row in enumerate(chunk):
+        array[i, :len(row)] = row
+      dataset.append({"inputs": array})
 
     predictions = []
-    for batch in dataset:
-      predicted_tokens = self._model.generate(
-          input_ids=self.to_tensor(batch["inputs"]), **generate_kwargs
-      )
-      predicted_tokens = predicted_tokens.cpu().numpy().tolist()
-      predictions.extend(
-          [vocabs["targets"].decode(p) for p in predicted_tokens]
-      )
+    with torch.inference_mode():
+      for batch in dataset:
+        predicted_tokens = self._model.generate(
+            input_ids=self._to_device(batch["inputs"]), **generate_kwargs
+        )
+        predicted_tokens = _trim_generated_tokens(predicted_tokens)
+        predictions.extend(
+            _decode_token_lists(vocabs["targets"], predicted_tokens)
+        )
 
     for inp, pred in zip(inputs, predictions):
       logging.info("%s\n  -> %s", inp, pred)
@@ -0,0 +1,95 @@
+# Copyright 2020 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for t5.models.hf_model."""
+
+from absl.testing import absltest
+import t5.data
+from t5.data import test_utils
+from t5.models import hf_model
+import tensorflow.compat.v1 as tf
+import tensorflow_datasets as tfds
+
+tf.disable_v2_behavior()
+tf.enable_eager_execution()
+
+_EOS_ID = 1
+_SEQUENCE_LENGTH = {"inputs": 13, "targets": 13}
+
+
+class TokensToBatchesTest(test_utils.FakeTaskTest):
+
+  def _task_batches(self, bucket_by_length):
+    task = t5.data.TaskRegistry.get("uncached_task")
+    ds = task.get_dataset(
+        _SEQUENCE_LENGTH, tfds.Split.TRAIN, use_cached=False, shuffle=False
+    )
+    return task, list(
+        hf_model.tokens_to_batches(
+            ds,
+            _SEQUENCE_LENGTH,
+            batch_size=2,
+            output_features=tuple(task.output_features),
+            bucket_by_length=bucket_by_length,
+        )
+    )
+
+  def _token_rows(self, batch, key):
+    """Yields (unpadded tokens, padded row) pairs for a batched feature."""
+    for row in batch[key]:
+      length = int((row != 0).sum())
+      yield list(row[:length]), row
+
+  def test_bucket_by_length_pads_to_longest_example(self):
+    task, batches = self._task_batches(bucket_by_length=True)
+    self.assertNotEmpty(batches)
+    for batch in batches:
+      for key in task.output_features:
+        rows = list(self._token_rows(batch, key))
+        # Each batch is padded only to its longest example.
+        self.assertEqual(
+            batch[key].shape[1], max(len(tokens) for tokens, _ in rows)
+        )
+        for tokens, row in rows:
+          # Exactly one EOS, as the final unpadded token, then only padding.
+          self.assertEqual([_EOS_ID], [t for t in tokens if t == _EOS_ID])
+          self.assertEqual(_EOS_ID, tokens[-1])
+          self.assertTrue((row[len(tokens):] == 0).all())
+
+  def test_bucket_by_length_matches_padded_tokens(self):
+    task, bucketed_batches = self._task_batches(bucket_by_length=True)
+    _, padded_batches = self._task_batches(bucket_by_length=False)
+
+    def _examples(batches):
+      examples = []
+      for batch in batches:
+        columns = [
+            [tokens for tokens, _ in self._token_rows(batch, key)]
+            for key in task.output_features
+        ]
+        examples.extend(
+            tuple(tuple(tokens) for tokens in example)
+            for example in zip(*columns)
+        )
+      return examples
+
+    # Bucketing may reorder examples across batches but must not change any
+    # (inputs, targets) token sequences relative to fixed-length padding.
+    self.assertCountEqual(
+        _examples(bucketed_batches), _examples(padded_batches)
+    )
+
+
+if __name__ == "__main__":
+  absltest.main()